@@ -204,7 +204,7 @@ class MiesNwbLoader(DatasetLoader):
         if chan == 'primary':
             scale = 1e-12 if rec.clamp_mode == 'vc' else 1e-3
             #data = np.array(rec.primary_hdf) * scale
-            data = np.array(self.hdf['acquisition']['timeseries'][rec.meta['sweep_name']]['data'])*scale
+            data = parser.read_scaled_data(self.hdf['acquisition']['timeseries'][rec.meta['sweep_name']]['data'], scale, dtype=parser.TRACE_DTYPE)
 
         elif chan == 'command':
             scale = 1e-3 if rec.clamp_mode == 'vc' else 1e-12
@@ -217,13 +217,13 @@ class MiesNwbLoader(DatasetLoader):
                 exc._ignorable_bug_flag = True
                 raise exc
             #self._data = (np.array(rec.command_hdf) * scale) + offset
-            data = (np.array(self.hdf['stimulus']['presentation']['data_%05d_DA%d'%(rec.sync_recording.key, self.get_da_chan(rec))]['data']) * scale) + offset
+            data = parser.read_scaled_data(self.hdf['stimulus']['presentation']['data_%05d_DA%d'%(rec.sync_recording.key, self.get_da_chan(rec))]['data'], scale, offset, dtype=parser.TRACE_DTYPE)
 
         elif chan == 'reporter':
             if 'AD' in rec.meta['sweep_name']:
-                data = np.array(self.hdf['acquisition']['timeseries'][rec.meta['sweep_name']]['data'])
+                data = parser.read_scaled_data(self.hdf['acquisition']['timeseries'][rec.meta['sweep_name']]['data'])
             elif 'TTL' in rec.meta['sweep_name']:
-                data = np.array(self.hdf['stimulus']['presentation'][rec.meta['sweep_name']]['data'])
+                data = parser.read_scaled_data(self.hdf['stimulus']['presentation'][rec.meta['sweep_name']]['data'])
             else:
                 raise Exception("Not sure where to find data for recording: %s"%rec.meta['sweep_name'])
 
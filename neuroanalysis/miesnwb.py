@@ -1,26 +1,47 @@
 from __future__ import print_function, division
-import sys
-from datetime import datetime
+import os, sys, json, threading
 from collections import OrderedDict
+from collections.abc import MutableMapping
 import numpy as np
 import h5py
 
 from .data import Dataset, SyncRecording, PatchClampRecording, TSeries
 from .test_pulse import PatchClampTestPulse
 from . import stimuli
+from .util.mies_nwb_parsing import read_scaled_data, igorpro_date, TRACE_DTYPE
 
 
 class MiesNwb(Dataset):
     """Class for accessing data from a MIES-generated NWB file.
+
+    If *cache_notebook* is True, the parsed lab notebook is stored in a
+    ``.nbcache.npz`` file next to the NWB file and reused when the same file
+    is opened again (the cache is discarded if the NWB file changes).
     """
-    def __init__(self, filename):
+    # increment when the format of parsed notebook data changes
+    _notebook_cache_version = 1
+
+    # HDF5 chunk cache settings (per open dataset); None uses the HDF5 default (1 MB).
+    # Trace data is read in full once and cached by MiesTSeries, so a larger cache
+    # rarely gets hits and only adds to the memory held by each open dataset.
+    chunk_cache_bytes = None
+    chunk_cache_slots = None
+
+    def __init__(self, filename, cache_notebook=False):
         Dataset.__init__(self)
         self.filename = filename
+        self.cache_notebook = cache_notebook
         self._hdf = None
         self._sweeps = None
         self._timeseries = None
         self._groups = None
         self._notebook = None
+        self._notebook_sweeps = {}
+        self._nb_records = None
+        self._tp_notebook = None
+        self._tp_entries = None
+        self._stim_keys = None
+        self._da_map = None
         self.open()
         
     @property
@@ -33,142 +54,286 @@ class MiesNwb(Dataset):
         """Return compiled data from the lab notebook.
 
         The format is a dict like ``{sweep_number: [ch1, ch2, ...]}`` that contains one key:value
-        pair per sweep. Each value is a list containing one metadata dict for each channel in the
-        sweep. For example::
+        pair per sweep. Each value is a list containing one metadata dict (a `MiesNotebookEntry`)
+        for each channel in the sweep. For example::
 
             nwb.notebook()[sweep_id][channel_id][metadata_key]
         """
         if self._notebook is None:
-            # collect all lab notebook entries
-            sweep_entries = OrderedDict()
-            tp_entries = []
-            device = list(self.hdf['general/devices'].keys())[0].split('_',1)[-1]
-            nb_keys = self.hdf['general']['labnotebook'][device]['numericalKeys'][0]
-            nb_fields = OrderedDict([(k, i) for i,k in enumerate(nb_keys)])
-
-            # convert notebook to array here, otherwise we incur the decompression cost for the entire
-            # dataset every time we try to access part of it. 
-            nb = np.array(self.hdf['general']['labnotebook'][device]['numericalValues'])
-
-            # EntrySourceType field is needed to distinguish between records created by TP vs sweep
-            entry_source_type_index = nb_fields.get('EntrySourceType', None)
+            cached = self._read_notebook_cache() if self.cache_notebook else None
+            if cached is None:
+                records = self._notebook_records()
+                notebook = {}
+                for swid in records['sweeps']:
+                    entries = self._notebook_sweeps.get(swid)
+                    notebook[swid] = self._compile_sweep_notebook(swid) if entries is None else entries
+                self._notebook = notebook
+                if self.cache_notebook:
+                    self._write_notebook_cache(self._notebook, self._tp_notebook, self._notebook_keys)
+            else:
+                self._notebook, self._tp_notebook, self._notebook_keys = cached
+            self._notebook_sweeps = None
+        return self._notebook
+
+    def _notebook_for_sweep(self, sweep_id):
+        """Return the list of per-channel notebook entries for a single sweep
+        (equivalent to ``notebook()[sweep_id]``).
+
+        Only the requested sweep is compiled, so code that touches a few sweeps
+        does not pay for the textual notebook entries of every sweep in the file.
+        """
+        if self._notebook is not None:
+            return self._notebook[sweep_id]
+        if self.cache_notebook:
+            # loading the cache gives us every sweep at once
+            return self.notebook()[sweep_id]
+        entries = self._notebook_sweeps.get(sweep_id)
+        if entries is None:
+            entries = self._compile_sweep_notebook(sweep_id)
+            self._notebook_sweeps[sweep_id] = entries
+        return entries
+
+    def _notebook_records(self):
+        """Read the lab notebook from the HDF5 file and sort its records by sweep.
+
+        Numerical records are classified and merged for all sweeps at once (this is
+        vectorized and cheap); textual records are only grouped by sweep here and
+        are applied later by _compile_sweep_notebook().
+        """
+        if self._nb_records is not None:
+            return self._nb_records
+
+        sweep_entries = {}
+        device = list(self.hdf['general/devices'].keys())[0].split('_',1)[-1]
+        lab_nb = self.hdf['general']['labnotebook'][device]
+        nb_keys = lab_nb['numericalKeys'][0]
+        nb_fields = {k: i for i, k in enumerate(nb_keys)}
+
+        # read the entire notebook in a single call here, otherwise we incur the decompression cost
+        # for the entire dataset every time we try to access part of it. All further indexing
+        # below operates on the in-memory array.
+        nb = lab_nb['numericalValues'][...]
+
+        n_rows = nb.shape[0]
+        sweep_nums = nb[:, 0, 0]
+
+        # EntrySourceType field is needed to distinguish between records created by TP vs sweep
+        # (note: entrySourceType is nan if an older pxp is re-exported to nwb using newer MIES)
+        entry_source_type_index = nb_fields.get('EntrySourceType', None)
+        if entry_source_type_index is None:
+            source_type = np.full(n_rows, np.nan)
+        else:
+            source_type = nb[:, entry_source_type_index, 0]
+        has_source_type = ~np.isnan(source_type)
+
+        # Older files may be missing EntrySourceType. In this case, we can identify TP blocks
+        # as two records containing a "TP Peak Resistance" value in the first record followed
+        # by a "TP Pulse Duration" value in the second record.
+        old_tp = np.zeros(n_rows, dtype=bool)
+        needs_check = ~has_source_type[:-1]
+        if needs_check.any():
+            tp_peak = np.isfinite(nb[:-1, nb_fields['TP Peak Resistance']]).any(axis=1)
+            tp_dur = np.isfinite(nb[1:, nb_fields['TP Pulse Duration']]).any(axis=1)
+            old_tp[:-1] = needs_check & tp_peak & tp_dur
+
+        is_tp = np.where(has_source_type, source_type != 0, old_tp)
+        is_sweep = np.where(has_source_type, source_type == 0, ~old_tp) & np.isfinite(sweep_nums)
+        # the last record can only be classified by its EntrySourceType
+        is_sweep[-1:] &= has_source_type[-1:]
+
+        # Each TP record is merged with the record that follows it. TP blocks detected in
+        # older files also swallow one extra record. Consumed records are not processed further,
+        # so this has to be resolved in order (but only TP records need to be visited).
+        consumed = np.zeros(n_rows, dtype=bool)
+        tp_starts = []
+        for i in np.flatnonzero(is_tp):
+            if consumed[i] or i == n_rows - 1:
+                continue
+            tp_starts.append(i)
+            consumed[i+1:i+3 if old_tp[i] else i+2] = True
+
+        tp_starts = np.array(tp_starts, dtype=int)
+        tp_recs = nb[tp_starts]
+        tp_next = nb[tp_starts + 1]
+        mask = ~np.isnan(tp_next)
+        tp_recs[mask] = tp_next[mask]
+        tp_entries = list(tp_recs)
+
+        # each sweep gets multiple nb records; for each field we use the last non-nan value in any record
+        sweep_rows = np.flatnonzero(is_sweep & ~consumed)
+        if len(sweep_rows) > 0:
+            sweep_ids = sweep_nums[sweep_rows].astype(int)
+            order = np.argsort(sweep_ids, kind='stable')
+            sweep_rows = sweep_rows[order]
+            recs = nb[sweep_rows]
+            uniq_ids, group_starts = np.unique(sweep_ids[order], return_index=True)
             
-            nb_iter = iter(range(nb.shape[0]))  # so we can skip multiple rows from within the loop
-            for i in nb_iter:
-                rec = nb[i]
-                sweep_num = rec[0,0]
-
-                is_tp_record = False
-                is_sweep_record = False
-
-                # ignore records that were generated by test pulse
-                # (note: entrySourceType is nan if an older pxp is re-exported to nwb using newer MIES)
-                if entry_source_type_index is not None and not np.isnan(rec[entry_source_type_index][0]):
-                    if rec[entry_source_type_index][0] == 0:
-                        is_sweep_record = True
-                    else:
-                        is_tp_record = True
-                elif i < nb.shape[0] - 1:
-                    # Older files may be missing EntrySourceType. In this case, we can identify TP blocks
-                    # as two records containing a "TP Peak Resistance" value in the first record followed
-                    # by a "TP Pulse Duration" value in the second record.
-                    tp_peak = rec[nb_fields['TP Peak Resistance']]
-                    if any(np.isfinite(tp_peak)):
-                        tp_dur = nb[i+1][nb_fields['TP Pulse Duration']]
-                        if any(np.isfinite(tp_dur)):
-                            next(nb_iter)
-                            is_tp_record = True
-                    if not is_tp_record:
-                        is_sweep_record = np.isfinite(sweep_num)
-
-                if is_tp_record:
-                    rec = np.array(rec)
-                    next(nb_iter)
-                    rec2 = np.array(nb[i+1])
-                    mask = ~np.isnan(rec2)
-                    rec[mask] = rec2[mask]
-                    tp_entries.append(rec)
-
-                elif is_sweep_record:
-                    sweep_num = int(sweep_num)
-                    # each sweep gets multiple nb records; for each field we use the last non-nan value in any record
-                    if sweep_num not in sweep_entries:
-                        sweep_entries[sweep_num] = np.array(rec)
-                    else:
-                        mask = ~np.isnan(rec)
-                        sweep_entries[sweep_num][mask] = rec[mask]
+            # index of the last non-nan record for each field, per sweep
+            rec_index = np.where(np.isnan(recs), -1, np.arange(len(recs))[:, None, None])
+            last = np.maximum.reduceat(rec_index, group_starts, axis=0)
+            merged = np.take_along_axis(recs, np.maximum(last, 0), axis=0)
+            merged[last < 0] = np.nan
+
+            # keep sweeps in the order they first appear in the notebook
+            for j in np.argsort(sweep_rows[group_starts]):
+                sweep_entries[int(uniq_ids[j])] = merged[j]
+
+        # Load textual keys in a similar way 
+        text_nb_keys = lab_nb['textualKeys'][0]
+        text_nb_fields = {k: i for i, k in enumerate(text_nb_keys)}
+        text_nb = lab_nb['textualValues'][...]
+        entry_source_type_index = text_nb_fields.get('EntrySourceType', None)
+
+        text_records = {}
+        for rec in text_nb:
+            if entry_source_type_index is None:
+                # older nwb files lack EntrySourceType; fake it for now
+                source_type = 0
+            else:
+                try:
+                    source_type = int(rec[entry_source_type_index, 0])
+                except ValueError:
+                    # No entry source type recorded here; skip for now.
+                    continue
 
-            for swid, entry in sweep_entries.items():
-                # last column is "global"; applies to all channels
-                mask = ~np.isnan(entry[:,8])
-                entry[mask] = entry[:,8:9][mask]
-    
-                # first 4 fields of first column apply to all channels
-                entry[:4] = entry[:4, 0:1]
-
-                # async AD fields (notably used to record temperature) appear
-                # only in column 0, but might move to column 8 later? Since these
-                # are not channel-specific, we'll copy them to all channels
-                for i,k in enumerate(nb_keys):
-                    if not k.startswith('Async AD '):
+            if source_type != 0:
+                # Select only sweep records for now.
+                continue
+
+            try:
+                sweep_id = int(rec[0,0])
+            except ValueError:
+                # Not sure how to handle records with no sweep ID; skip for now.
+                continue
+            text_records.setdefault(sweep_id, []).append(rec)
+
+        self._tp_notebook = tp_entries
+        self._notebook_keys = nb_fields
+        self._nb_records = {
+            'sweeps': sweep_entries,
+            'async_ad_fields': np.array([i for k,i in nb_fields.items() if k.startswith('Async AD ')], dtype=int),
+            'text_fields': text_nb_fields,
+            'text_records': text_records,
+        }
+        return self._nb_records
+
+    def _compile_sweep_notebook(self, sweep_id):
+        """Return the list of per-channel notebook entries for one sweep.
+        """
+        records = self._notebook_records()
+        entry = records['sweeps'][sweep_id]
+        nb_fields = self._notebook_keys
+
+        # last column is "global"; applies to all channels
+        mask = ~np.isnan(entry[:,8])
+        entry[mask] = entry[:,8:9][mask]
+
+        # first 4 fields of first column apply to all channels
+        entry[:4] = entry[:4, 0:1]
+
+        # async AD fields (notably used to record temperature) appear
+        # only in column 0, but might move to column 8 later? Since these
+        # are not channel-specific, we'll copy them to all channels
+        async_ad = records['async_ad_fields']
+        entry[async_ad] = entry[async_ad, 0:1]
+
+        # convert to a list of per-channel views on the sweep array
+        sweep_entry = [MiesNotebookEntry(entry[:, i], nb_fields) for i in range(entry.shape[1])]
+
+        text_nb_fields = records['text_fields']
+        for rec in records['text_records'].get(sweep_id, []):
+            for k,i in text_nb_fields.items():                    
+                for j, val in enumerate(rec[i, :-1]):
+                    if k in sweep_entry[j]:
+                        # already have a value here; don't overwrite.
                         continue
-                    entry[i] = entry[i, 0]
-
-                # convert to list-o-dicts
-                meta = []
-                for i in range(entry.shape[1]):
-                    tm = entry[:, i]
-                    meta.append(OrderedDict([(nb_keys[j], (None if np.isnan(tm[j]) else tm[j])) for j in range(len(nb_keys))]))
-                sweep_entries[swid] = meta
-
-            # Load textual keys in a similar way 
-            text_nb_keys = self.hdf['general']['labnotebook'][device]['textualKeys'][0]
-            text_nb_fields = OrderedDict([(k, i) for i,k in enumerate(text_nb_keys)])
-            text_nb = np.array(self.hdf['general']['labnotebook'][device]['textualValues'])
-            entry_source_type_index = text_nb_fields.get('EntrySourceType', None)
-
-            for rec in text_nb:
-                if entry_source_type_index is None:
-                    # older nwb files lack EntrySourceType; fake it for now
-                    source_type = 0
-                else:
-                    try:
-                        source_type = int(rec[entry_source_type_index, 0])
-                    except ValueError:
-                        # No entry source type recorded here; skip for now.
+
+                    if val == '':
+                        # take value from last column if this one is empty
+                        val == rec[i, -1]
+                    if val == '':
+                        # no value here; skip.
                         continue
+                    
+                    sweep_entry[j][k] = val
 
-                if source_type != 0:
-                    # Select only sweep records for now.
-                    continue
+        return sweep_entry
 
-                try:
-                    sweep_id = int(rec[0,0])
-                except ValueError:
-                    # Not sure how to handle records with no sweep ID; skip for now.
-                    continue
-                sweep_entry = sweep_entries[sweep_id]
-
-                for k,i in text_nb_fields.items():                    
-                    for j, val in enumerate(rec[i, :-1]):
-                        if k in sweep_entry[j]:
-                            # already have a value here; don't overwrite.
-                            continue
-
-                        if val == '':
-                            # take value from last column if this one is empty
-                            val == rec[i, -1]
-                        if val == '':
-                            # no value here; skip.
-                            continue
-                        
-                        sweep_entry[j][k] = val
-
-            self._notebook = sweep_entries
-            self._tp_notebook = tp_entries
-            self._notebook_keys = nb_fields
-            self._tp_entries = None
-        return self._notebook
+    def _notebook_cache_file(self):
+        return self.filename + '.nbcache.npz'
+
+    def _file_stat(self):
+        stat = os.stat(self.filename)
+        return [stat.st_mtime, stat.st_size]
+
+    def _read_notebook_cache(self):
+        """Return notebook data from the cache file next to the NWB file, or None
+        if the cache is missing or was not generated from the current file.
+
+        The cache holds only plain arrays and JSON, so it is loaded without unpickling.
+        """
+        cache_file = self._notebook_cache_file()
+        if not os.path.isfile(cache_file):
+            return None
+        try:
+            with np.load(cache_file, allow_pickle=False) as cache:
+                header = json.loads(str(cache['header']))
+                if header['version'] != self._notebook_cache_version or header['file_stat'] != self._file_stat():
+                    return None
+                sweep_ids = cache['sweep_ids']
+                sweeps = cache['sweeps']
+                tp_notebook = list(cache['tp'])
+
+            nb_fields = {k: i for k, i in header['fields']}
+            text = header['text']
+            n_keys = max(nb_fields.values()) + 1 if len(nb_fields) > 0 else 0
+            if not (len(sweep_ids) == len(sweeps) == len(text)) or sweeps.ndim != 3 or sweeps.shape[1] != n_keys:
+                raise ValueError("inconsistent cache contents")
+
+            notebook = {}
+            for swid, entry, sweep_text in zip(sweep_ids, sweeps, text):
+                if len(sweep_text) != entry.shape[1]:
+                    raise ValueError("inconsistent cache contents")
+                sweep_entry = [MiesNotebookEntry(entry[:, i], nb_fields) for i in range(entry.shape[1])]
+                for ch_entry, ch_text in zip(sweep_entry, sweep_text):
+                    ch_entry._text.update(ch_text)
+                notebook[int(swid)] = sweep_entry
+        except Exception as exc:
+            print("Warning: ignoring unreadable notebook cache %s: %s" % (cache_file, exc))
+            return None
+        return notebook, tp_notebook, nb_fields
+
+    def _write_notebook_cache(self, notebook, tp_notebook, nb_fields):
+        cache_file = self._notebook_cache_file()
+        shape = (0, len(nb_fields), 9)
+        sweeps = [np.stack([ch._values for ch in entries], axis=1) for entries in notebook.values()]
+        header = {
+            'version': self._notebook_cache_version,
+            'file_stat': self._file_stat(),
+            # exact key->index table; keys may repeat in numericalKeys, so the
+            # indices can not be rebuilt from the key names alone
+            'fields': list(nb_fields.items()),
+            'text': [[ch._text for ch in entries] for entries in notebook.values()],
+        }
+        # Write to a temporary file unique to this process / thread, then move it into place,
+        # so concurrent writers never interleave. (mkstemp is not used because its files are
+        # private to the owner, which would make the cache unreadable in shared directories.)
+        tmp_file = '%s.%d.%d.tmp' % (cache_file, os.getpid(), threading.get_ident())
+        try:
+            with open(tmp_file, 'wb') as fh:
+                np.savez(fh,
+                    header=np.array(json.dumps(header)),
+                    sweep_ids=np.array(list(notebook.keys()), dtype=int),
+                    sweeps=np.array(sweeps) if len(sweeps) > 0 else np.empty(shape),
+                    tp=np.array(tp_notebook) if len(tp_notebook) > 0 else np.empty(shape),
+                )
+            os.replace(tmp_file, cache_file)
+        except (IOError, OSError, TypeError, ValueError) as exc:
+            print("Warning: could not write notebook cache %s: %s" % (cache_file, exc))
+            try:
+                os.remove(tmp_file)
+            except OSError:
+                pass
 
     @property
     def contents(self):
@@ -176,13 +341,16 @@ class MiesNwb(Dataset):
         """
         if self._sweeps is None:
             # sort all timeseries groups into sweeps / channels
+            # (group names look like "data_00012_AD3"; parsing the name avoids opening
+            # every group to read its "source" attribute)
             self._timeseries = {}
-            for ts_name, ts in self.hdf['acquisition/timeseries'].items():
-                src = dict([field.split('=') for field in ts.attrs['source'].split(';')])
-                sweep = int(src['Sweep'])
-                ad_chan = int(src['AD'])
-                src['hdf_group_name'] = 'acquisition/timeseries/' + ts_name
-                self._timeseries.setdefault(sweep, {})[ad_chan] = src
+            for ts_name in self.hdf['acquisition/timeseries'].keys():
+                prefix, _, rest = ts_name.partition('_')
+                sweep, sep, ad_chan = rest.partition('_AD')
+                if prefix != 'data' or sep == '':
+                    continue
+                src = {'Sweep': sweep, 'AD': ad_chan, 'hdf_group_name': 'acquisition/timeseries/' + ts_name}
+                self._timeseries.setdefault(int(sweep), {})[int(ad_chan)] = src
             
             sweep_ids = sorted(list(self._timeseries.keys()))
             self._sweeps = []
@@ -191,6 +359,41 @@ class MiesNwb(Dataset):
                 self._sweeps.append(srec)
         return self._sweeps
     
+    def stimulus_keys(self):
+        """Return a list of all group names under stimulus/presentation.
+
+        The list is read once and cached; listing the group requires walking
+        HDF5 metadata, which is slow on files with many sweeps.
+        """
+        if self._stim_keys is None:
+            self._stim_keys = list(self.hdf['stimulus/presentation'].keys())
+        return self._stim_keys
+
+    def da_chan_map(self):
+        """Return a dict mapping ``(sweep_id, headstage_id)`` to the DA channel
+        used to stimulate that headstage.
+
+        All stimulus electrode names are read in a single pass the first time
+        this is called. DA channels that are not connected to a headstage
+        (for example, those driving an LED) are not included.
+        """
+        if self._da_map is None:
+            self._da_map = {}
+            hdf = self.hdf['stimulus/presentation']
+            for k in self.stimulus_keys():
+                parts = k.split('_')
+                if len(parts) != 3 or not parts[2].startswith('DA'):
+                    # TTL channels have no associated headstage
+                    continue
+                grp = hdf[k]
+                if 'electrode_name' not in grp:
+                    continue
+                elec = grp['electrode_name'][()][0].split('_')
+                if len(elec) != 2 or elec[0] != 'electrode' or not elec[1].isdigit():
+                    continue
+                self._da_map[(int(parts[1]), int(elec[1]))] = int(parts[2][2:])
+        return self._da_map
+
     def create_sync_recording(self, sweep_id):
         return MiesSyncRecording(self, sweep_id)
 
@@ -202,7 +405,7 @@ class MiesNwb(Dataset):
         if self._hdf is not None:
             return
         try:
-            self._hdf = h5py.File(self.filename, 'r')
+            self._hdf = h5py.File(self.filename, 'r', rdcc_nbytes=self.chunk_cache_bytes, rdcc_nslots=self.chunk_cache_slots)
         except Exception:
             print("Error opening: %s" % self.filename)
             raise
@@ -223,10 +426,17 @@ class MiesNwb(Dataset):
 
         All sweeps must have the same length and number of channels.
         """
-        sweeps = [s.data() for s in sweeps]
-        data = np.empty((len(sweeps),) + sweeps[0].shape, dtype=sweeps[0].dtype)
-        for i in range(len(sweeps)):
-            data[i] = sweeps[i]
+        # Channel data is copied straight into the output array; going through
+        # SyncRecording.data() would build two intermediate copies per sweep.
+        sweeps = list(sweeps)
+        first = [[rec[ch].data for ch in rec.channels] for rec in sweeps[0].recordings]
+        dtype = np.result_type(*[d for rec_data in first for d in rec_data])
+        shape = (len(sweeps), len(first), len(first[0][0]), len(first[0]))
+        data = np.empty(shape, dtype=dtype)
+        for i, sweep in enumerate(sweeps):
+            for j, rec in enumerate(sweep.recordings):
+                for k, ch in enumerate(rec.channels):
+                    data[i, j, :, k] = rec[ch].data
         return data
 
     @staticmethod
@@ -234,8 +444,7 @@ class MiesNwb(Dataset):
         """Convert an IgorPro timestamp (seconds since 1904-01-01) to a datetime
         object.
         """
-        dt = datetime(1970,1,1) - datetime(1904,1,1)
-        return datetime.utcfromtimestamp(timestamp) - dt
+        return igorpro_date(timestamp)
 
     @property
     def children(self):
@@ -252,6 +461,8 @@ class MiesNwb(Dataset):
 
     def test_pulse_entries(self):
         if self._tp_entries is None:
+            if self._tp_notebook is None:
+                self._notebook_records()
             self._tp_entries = []
             fields = ['TP Baseline Vm', 'TP Baseline pA', 'TP Peak Resistance', 'TP Steady State Resistance']
             stim_fields = ['TP Baseline Fraction', 'TP Amplitude VC', 'TP Amplitude IC', 'TP Pulse Duration']
@@ -265,13 +476,74 @@ class MiesNwb(Dataset):
         return self._tp_entries
 
 
+class MiesNotebookEntry(MutableMapping):
+    """Dict-like lab notebook metadata for one channel of one sweep.
+
+    Numerical values are read on demand from a column of the sweep's notebook
+    array, so no per-field Python objects are created while parsing the
+    notebook. As with the rest of the notebook, nan values are returned as None.
+    Assigned values (including textual notebook values) are stored separately
+    and take precedence over numerical values with the same key; the notebook
+    array itself is never modified.
+    """
+    def __init__(self, values, fields):
+        self._values = values
+        self._fields = fields
+        self._text = {}
+        self._deleted = set()
+
+    def __getitem__(self, key):
+        if key in self._text:
+            return self._text[key]
+        if key in self._deleted:
+            raise KeyError(key)
+        val = self._values[self._fields[key]]
+        return None if np.isnan(val) else val
+
+    def __setitem__(self, key, val):
+        self._text[key] = val
+        self._deleted.discard(key)
+
+    def __delitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        self._text.pop(key, None)
+        if key in self._fields:
+            self._deleted.add(key)
+
+    def __contains__(self, key):
+        return key in self._text or (key in self._fields and key not in self._deleted)
+
+    def __iter__(self):
+        for k in self._fields:
+            if k in self:
+                yield k
+        for k in self._text:
+            if k not in self._fields:
+                yield k
+
+    def __len__(self):
+        return len(self._fields) - len(self._deleted) + len([k for k in self._text if k not in self._fields])
+
+    def copy(self):
+        """Return a plain dict containing the same keys and values.
+        """
+        return dict(self)
+
+    def __repr__(self):
+        return "<%s %r>" % (self.__class__.__name__, dict(self))
+
+
 class MiesTSeries(TSeries):
+    dtype = TRACE_DTYPE
+
     def __init__(self, recording, chan):
         start = recording._meta['start_time']
         
         # Note: this is also available in meta()['Minimum Sampling interval'],
         # but that key is missing in some older NWB files.
         dt = recording.primary_hdf.attrs['IGORWaveScaling'][1,0] / 1000.
+        self._shape = None
         TSeries.__init__(self, recording=recording, channel_id=chan, dt=dt, start_time=start)
     
     @property
@@ -279,33 +551,36 @@ class MiesTSeries(TSeries):
         if self._data is None:
             rec = self.recording
             chan = self.channel_id
+            clamp_mode = rec.clamp_mode
             if chan == 'primary':
-                scale = 1e-12 if rec.clamp_mode == 'vc' else 1e-3
-                self._data = np.array(rec.primary_hdf) * scale
+                scale = 1e-12 if clamp_mode == 'vc' else 1e-3
+                self._data = read_scaled_data(rec.primary_hdf, scale, dtype=self.dtype)
             elif chan == 'command':
-                scale = 1e-3 if rec.clamp_mode == 'vc' else 1e-12
+                scale = 1e-3 if clamp_mode == 'vc' else 1e-12
                 # command values are stored _without_ holding, so we add
                 # that back in here.
-                offset = rec.holding_potential if rec.clamp_mode == 'vc' else rec.holding_current
+                offset = rec.holding_potential if clamp_mode == 'vc' else rec.holding_current
                 if offset is None:
                     exc = Exception("Holding value unknown for this recording; cannot generate command data.")
                     # Mark this exception so it can be ignored in specific places
                     exc._ignorable_bug_flag = True
                     raise exc
-                self._data = (np.array(rec.command_hdf) * scale) + offset
+                self._data = read_scaled_data(rec.command_hdf, scale, offset, dtype=self.dtype)
 
         return self._data
-    
+
     @property
     def shape(self):
         # allow accessing shape without reading all data
         if self._data is None:
-            rec = self.recording
-            chan = self.channel_id
-            if chan == 'primary':
-                return rec.primary_hdf.shape
-            elif chan == 'command':
-                return rec.command_hdf.shape
+            if self._shape is None:
+                rec = self.recording
+                chan = self.channel_id
+                if chan == 'primary':
+                    self._shape = rec.primary_hdf.shape
+                elif chan == 'command':
+                    self._shape = rec.command_hdf.shape
+            return self._shape
         else:
             return self._data.shape
         
@@ -329,7 +604,7 @@ class MiesRecording(PatchClampRecording):
                                      sync_recording=sweep)
 
         # update metadata
-        nb = self._nwb.notebook()[int(self._trace_id[0])][headstage_id]
+        nb = self._nwb._notebook_for_sweep(int(self._trace_id[0]))[headstage_id]
         self.meta['holding_potential'] = (
             None if nb['V-Clamp Holding Level'] is None
             else nb['V-Clamp Holding Level'] * 1e-3
@@ -339,10 +614,9 @@ class MiesRecording(PatchClampRecording):
             else nb['I-Clamp Holding Level'] * 1e-12
         )   
         self._meta['notebook'] = nb
-        if nb['Clamp Mode'] == 0:
-            self._meta['clamp_mode'] = 'vc'
-        else:
-            self._meta['clamp_mode'] = 'ic'
+        self._clamp_mode = 'vc' if nb['Clamp Mode'] == 0 else 'ic'
+        self._meta['clamp_mode'] = self._clamp_mode
+        if self._clamp_mode == 'ic':
             self._meta['bridge_balance'] = (
                 0.0 if nb['Bridge Bal Enable'] == 0.0 or nb['Bridge Bal Value'] is None
                 else nb['Bridge Bal Value'] * 1e6
@@ -393,13 +667,13 @@ class MiesRecording(PatchClampRecording):
 
     @property
     def clamp_mode(self):
-        return 'vc' if self.meta['notebook']['Clamp Mode'] == 0 else 'ic'
+        return self._clamp_mode
 
     @property
     def primary_hdf(self):
         """The raw HDF5 data containing the primary channel recording
         """
-        return self.hdf_group['data']        
+        return self.hdf_group['data']
 
     @property
     def command_hdf(self):
@@ -487,14 +761,10 @@ class MiesRecording(PatchClampRecording):
         """Return the DA channel ID for this recording.
         """
         if self._da_chan is None:
-            hdf = self._nwb.hdf['stimulus/presentation']
-            stims = [k for k in hdf.keys() if k.startswith('data_%05d_'%self._trace_id[0])]
-            for s in stims:
-                elec = hdf[s]['electrode_name'][()][0]
-                if elec == 'electrode_%d' % self.device_id:
-                    self._da_chan = int(s.split('_')[-1][2:])
-            if self._da_chan is None:
+            da_chan = self._nwb.da_chan_map().get((self._trace_id[0], self.device_id))
+            if da_chan is None:
                 raise Exception("Cannot find DA channel for headstage %d" % self.device_id)
+            self._da_chan = da_chan
         return self._da_chan
 
     def _descr(self):
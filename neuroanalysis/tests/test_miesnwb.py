@@ -0,0 +1,309 @@
+import os, json, pickle, threading
+import numpy as np
+import h5py
+import pytest
+from neuroanalysis.miesnwb import MiesNwb, MiesNotebookEntry
+
+
+str_dtype = h5py.special_dtype(vlen=str)
+
+
+@pytest.fixture(autouse=True)
+def str_reads(monkeypatch):
+    # MiesNwb expects string datasets to be read as str (h5py < 3 behavior);
+    # newer h5py versions return bytes instead.
+    if int(h5py.__version__.split('.')[0]) < 3:
+        return
+    getitem = h5py.Dataset.__getitem__
+
+    def decode(val):
+        if isinstance(val, bytes):
+            return val.decode()
+        if isinstance(val, np.ndarray) and val.dtype == object:
+            return np.array([decode(v) for v in val.flat], dtype=object).reshape(val.shape)
+        return val
+
+    def __getitem__(self, *args, **kwds):
+        val = getitem(self, *args, **kwds)
+        return decode(val) if h5py.check_string_dtype(self.dtype) is not None else val
+
+    monkeypatch.setattr(h5py.Dataset, '__getitem__', __getitem__)
+
+
+def make_record(keys, values):
+    """Return one lab notebook record with values given as {(key, column): value}.
+    All other values are nan.
+    """
+    rec = np.full((len(keys), 9), np.nan)
+    for (key, col), val in values.items():
+        rec[keys.index(key), col] = val
+    return rec
+
+
+def write_notebook(filename, keys, records, text_records=()):
+    """Write a MIES file containing only a lab notebook with the given numerical
+    and textual records.
+    """
+    text_keys = ['SweepNum', 'TimeStamp', 'EntrySourceType', 'Stim Wave Note']
+    text_values = np.full((len(text_records), len(text_keys), 9), '', dtype=object)
+    for i, rec in enumerate(text_records):
+        for (key, col), val in rec.items():
+            text_values[i, text_keys.index(key), col] = val
+    with h5py.File(filename, 'w') as f:
+        f.create_group('general/devices/device_ITC18USB_Dev_0')
+        nb = f.create_group('general/labnotebook/ITC18USB_Dev_0')
+        nb.create_dataset('numericalKeys', data=np.array([keys], dtype=object), dtype=str_dtype)
+        nb.create_dataset('numericalValues', data=np.array([make_record(keys, r) for r in records]))
+        nb.create_dataset('textualKeys', data=np.array([text_keys], dtype=object), dtype=str_dtype)
+        nb.create_dataset('textualValues', data=text_values, shape=text_values.shape, dtype=str_dtype)
+
+
+nb_keys = ['SweepNum', 'TimeStamp', 'TimeStampUTC', 'EntrySourceType', 'Clamp Mode',
+           'TP Peak Resistance', 'TP Pulse Duration', 'Async AD 0 [Temp]']
+
+
+def test_notebook_entry_source_type(tmp_path):
+    filename = str(tmp_path / 'notebook.nwb')
+    write_notebook(filename, nb_keys, [
+        # test pulse; the second record is merged into the first
+        {('EntrySourceType', 0): 1, ('TimeStamp', 0): 100, ('TP Peak Resistance', 0): 5},
+        {('EntrySourceType', 0): 1, ('TP Pulse Duration', 8): 10},
+        # sweep 0 is split across two records, with sweep 1 in between
+        {('SweepNum', 0): 0, ('EntrySourceType', 0): 0, ('TimeStamp', 0): 110, ('Clamp Mode', 0): 0, ('Clamp Mode', 1): 1},
+        {('SweepNum', 0): 1, ('EntrySourceType', 0): 0, ('TimeStamp', 0): 120, ('Clamp Mode', 0): 1},
+        {('SweepNum', 0): 0, ('EntrySourceType', 0): 0, ('Clamp Mode', 1): 0, ('Async AD 0 [Temp]', 0): 30, ('TP Pulse Duration', 8): 10},
+        # test pulse in the last record has nothing to merge with and is ignored
+        {('SweepNum', 0): 1, ('EntrySourceType', 0): 1, ('TP Peak Resistance', 0): 7},
+    ])
+
+    nwb = MiesNwb(filename)
+    nb = nwb.notebook()
+    assert list(nb.keys()) == [0, 1]
+    assert len(nb[0]) == 9
+
+    ch0, ch1, ch2 = nb[0][:3]
+    assert ch0['Clamp Mode'] == 0
+    assert ch1['Clamp Mode'] == 0  # later record takes precedence
+    assert ch2['Clamp Mode'] is None
+    # first 4 fields, async AD fields and the global column apply to all channels
+    for ch in (ch0, ch1, ch2):
+        assert ch['SweepNum'] == 0
+        assert ch['TimeStamp'] == 110
+        assert ch['EntrySourceType'] == 0
+        assert ch['Async AD 0 [Temp]'] == 30
+        assert ch['TP Pulse Duration'] == 10
+        assert ch['TP Peak Resistance'] is None
+
+    assert nb[1][0]['Clamp Mode'] == 1
+    assert nb[1][0]['TimeStamp'] == 120
+    assert nb[1][0]['TP Peak Resistance'] is None
+    assert nb[1][0]['TP Pulse Duration'] is None
+
+    assert len(nwb._tp_notebook) == 1
+    tp = nwb._tp_notebook[0]
+    assert tp[nb_keys.index('TimeStamp'), 0] == 100
+    assert tp[nb_keys.index('TP Peak Resistance'), 0] == 5
+    assert tp[nb_keys.index('TP Pulse Duration'), 8] == 10
+    nwb.close()
+
+
+def test_notebook_old_tp_records(tmp_path):
+    # older files lack EntrySourceType; test pulses are identified by their TP fields instead
+    keys = [k for k in nb_keys if k != 'EntrySourceType']
+    filename = str(tmp_path / 'notebook.nwb')
+    write_notebook(filename, keys, [
+        {('TimeStamp', 0): 100, ('TP Peak Resistance', 0): 5},
+        {('TP Pulse Duration', 8): 10},
+        # old-style test pulses also consume the record that follows them
+        {('SweepNum', 0): 5, ('Clamp Mode', 0): 1},
+        {('SweepNum', 0): 0, ('TimeStamp', 0): 110, ('Clamp Mode', 0): 1},
+        {('SweepNum', 0): 1, ('Clamp Mode', 0): 0},
+        {('SweepNum', 0): 0, ('Clamp Mode', 1): 1},
+        # the last record can not be classified without EntrySourceType and is ignored
+        {('SweepNum', 0): 0, ('Clamp Mode', 0): 0, ('TP Peak Resistance', 0): 7},
+    ])
+
+    nwb = MiesNwb(filename)
+    nb = nwb.notebook()
+    assert list(nb.keys()) == [0, 1]
+    assert nb[0][0]['Clamp Mode'] == 1
+    assert nb[0][1]['Clamp Mode'] == 1
+    assert nb[0][1]['TimeStamp'] == 110
+    assert nb[0][0]['TP Peak Resistance'] is None
+    assert nb[1][0]['Clamp Mode'] == 0
+
+    assert len(nwb._tp_notebook) == 1
+    tp = nwb._tp_notebook[0]
+    assert tp[keys.index('TP Peak Resistance'), 0] == 5
+    assert tp[keys.index('TP Pulse Duration'), 8] == 10
+    assert np.isnan(tp[keys.index('Clamp Mode'), 0])
+    nwb.close()
+
+
+def test_notebook_entry():
+    fields = {'SweepNum': 0, 'Clamp Mode': 1, 'LPF Cutoff': 2}
+    entry = MiesNotebookEntry(np.array([3., np.nan, 10e3]), fields)
+    entry['Stim Wave Note'] = 'note'
+    entry['LPF Cutoff'] = 'text value'
+
+    # indexing; nan values are returned as None and text values take precedence
+    assert entry['SweepNum'] == 3
+    assert entry['Clamp Mode'] is None
+    assert entry['LPF Cutoff'] == 'text value'
+    assert entry['Stim Wave Note'] == 'note'
+    with pytest.raises(KeyError):
+        entry['TP Peak Resistance']
+    assert entry.get('TP Peak Resistance') is None
+    assert 'Clamp Mode' in entry
+    assert 'TP Peak Resistance' not in entry
+
+    # iteration order matches the notebook fields, followed by text-only fields
+    assert list(entry) == ['SweepNum', 'Clamp Mode', 'LPF Cutoff', 'Stim Wave Note']
+    assert len(entry) == 4
+    assert entry == {'SweepNum': 3, 'Clamp Mode': None, 'LPF Cutoff': 'text value', 'Stim Wave Note': 'note'}
+
+    # dict methods
+    copy = entry.copy()
+    assert isinstance(copy, dict) and copy == entry
+    assert entry.setdefault('Clamp Mode', 1) is None
+    assert entry.setdefault('Set Sweep Count', 2) == 2
+    entry.update({'SweepNum': 4})
+    assert entry['SweepNum'] == 4
+    del entry['Clamp Mode']
+    assert 'Clamp Mode' not in entry
+    assert list(entry) == ['SweepNum', 'LPF Cutoff', 'Stim Wave Note', 'Set Sweep Count']
+    entry['Clamp Mode'] = 0
+    assert entry['Clamp Mode'] == 0
+    assert entry.pop('Stim Wave Note') == 'note'
+    assert len(entry) == 4
+    # the underlying notebook array is not modified
+    assert entry._values[0] == 3
+    assert copy['SweepNum'] == 3
+
+    # pickling
+    entry2 = pickle.loads(pickle.dumps(entry))
+    assert isinstance(entry2, MiesNotebookEntry)
+    assert entry2 == entry
+    assert list(entry2) == list(entry)
+
+
+def test_notebook_cache(tmp_path, monkeypatch):
+    filename = str(tmp_path / 'notebook.nwb')
+    cache_file = filename + '.nbcache.npz'
+    write_notebook(filename, nb_keys, [
+        {('EntrySourceType', 0): 1, ('TimeStamp', 0): 100, ('TP Peak Resistance', 0): 5},
+        {('EntrySourceType', 0): 1, ('TP Pulse Duration', 8): 10},
+        {('SweepNum', 0): 0, ('EntrySourceType', 0): 0, ('Clamp Mode', 0): 0, ('Clamp Mode', 1): 1},
+        {('SweepNum', 0): 3, ('EntrySourceType', 0): 0, ('Clamp Mode', 0): 1},
+    ], text_records=[
+        {('SweepNum', 0): '3', ('EntrySourceType', 0): '0', ('Stim Wave Note', 0): 'note'},
+    ])
+
+    # first load writes the cache
+    nwb = MiesNwb(filename, cache_notebook=True)
+    nb = nwb.notebook()
+    tp = nwb._tp_notebook
+    nwb.close()
+    assert os.path.isfile(cache_file)
+
+    # second load reads it back without parsing the notebook
+    nwb = MiesNwb(filename, cache_notebook=True)
+    cached = nwb.notebook()
+    assert nwb._nb_records is None
+    assert list(cached.keys()) == [0, 3]
+    for swid in nb:
+        assert [dict(ch) for ch in cached[swid]] == [dict(ch) for ch in nb[swid]]
+    assert cached[3][0]['Stim Wave Note'] == 'note'
+    assert 'Stim Wave Note' not in cached[0][0]
+    assert len(nwb._tp_notebook) == 1
+    np.testing.assert_array_equal(nwb._tp_notebook[0], tp[0])
+    assert nwb._notebook_keys == {k: i for i, k in enumerate(nb_keys)}
+    nwb.close()
+
+    # cache is ignored if the file was modified
+    stat = os.stat(filename)
+    os.utime(filename, (stat.st_atime, stat.st_mtime + 10))
+    assert MiesNwb(filename, cache_notebook=True)._read_notebook_cache() is None
+    os.utime(filename, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    assert MiesNwb(filename, cache_notebook=True)._read_notebook_cache() is not None
+    with h5py.File(filename, 'a') as f:
+        f['extra'] = np.zeros(1000)
+    os.utime(filename, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    assert os.stat(filename).st_size != stat.st_size
+    assert MiesNwb(filename, cache_notebook=True)._read_notebook_cache() is None
+
+    # rewrite the cache for the modified file
+    MiesNwb(filename, cache_notebook=True).notebook()
+    assert MiesNwb(filename, cache_notebook=True)._read_notebook_cache() is not None
+
+    # cache is ignored if it was written by a different version
+    with monkeypatch.context() as m:
+        m.setattr(MiesNwb, '_notebook_cache_version', MiesNwb._notebook_cache_version + 1)
+        assert MiesNwb(filename, cache_notebook=True)._read_notebook_cache() is None
+
+    # caches with a valid header but inconsistent contents are ignored
+    with np.load(cache_file) as cache:
+        arrays = dict(cache)
+    header = json.loads(str(arrays['header']))
+    bad_caches = [
+        dict(arrays, header=np.array(json.dumps(dict(header, text=header['text'][:1])))),
+        dict(arrays, header=np.array(json.dumps(dict(header, text=[t[:3] for t in header['text']])))),
+        dict(arrays, header=np.array(json.dumps(dict(header, fields=header['fields'][:3])))),
+        dict(arrays, header=np.array(json.dumps({'version': header['version'], 'file_stat': header['file_stat']}))),
+        dict(arrays, sweep_ids=arrays['sweep_ids'][:1]),
+    ]
+    for bad_cache in bad_caches:
+        np.savez(cache_file, **bad_cache)
+        nwb = MiesNwb(filename, cache_notebook=True)
+        assert nwb._read_notebook_cache() is None
+        assert list(nwb.notebook().keys()) == [0, 3]
+
+    # unreadable cache files are ignored and replaced
+    with open(cache_file, 'wb') as fh:
+        fh.write(b'not a cache file')
+    nwb = MiesNwb(filename, cache_notebook=True)
+    assert nwb._read_notebook_cache() is None
+    assert list(nwb.notebook().keys()) == [0, 3]
+    assert MiesNwb(filename, cache_notebook=True)._read_notebook_cache() is not None
+
+    # failed writes leave no temporary files behind and keep the existing cache
+    nwb = MiesNwb(filename, cache_notebook=True)
+    nb = nwb.notebook()
+    nb[0][0]['Stim Wave Note'] = object()  # not JSON serializable
+    nwb._write_notebook_cache(nb, nwb._tp_notebook, nwb._notebook_keys)
+    assert sorted(os.listdir(str(tmp_path))) == ['notebook.nwb', 'notebook.nwb.nbcache.npz']
+    assert MiesNwb(filename, cache_notebook=True)._read_notebook_cache() is not None
+
+    # concurrent writers do not corrupt the cache
+    os.remove(cache_file)
+    writers = [threading.Thread(target=MiesNwb(filename, cache_notebook=True).notebook) for i in range(8)]
+    for t in writers:
+        t.start()
+    for t in writers:
+        t.join()
+    assert sorted(os.listdir(str(tmp_path))) == ['notebook.nwb', 'notebook.nwb.nbcache.npz']
+    assert MiesNwb(filename, cache_notebook=True)._read_notebook_cache() is not None
+
+    # cache files containing pickled objects are never unpickled
+    np.savez(cache_file, header=np.array([{}], dtype=object))
+    assert MiesNwb(filename, cache_notebook=True)._read_notebook_cache() is None
+
+
+def test_notebook_cache_repeated_keys(tmp_path):
+    # numericalKeys may contain repeated (e.g. empty) names; later fields must keep their indices
+    keys = ['SweepNum', 'TimeStamp', 'TimeStampUTC', 'EntrySourceType', '', '', 'Clamp Mode', 'LPF Cutoff']
+    filename = str(tmp_path / 'notebook.nwb')
+    write_notebook(filename, keys, [
+        {('SweepNum', 0): 0, ('EntrySourceType', 0): 0, ('Clamp Mode', 0): 1},
+    ])
+
+    nb = MiesNwb(filename, cache_notebook=True).notebook()
+    assert nb[0][0]['Clamp Mode'] == 1
+    assert nb[0][0]['LPF Cutoff'] is None
+
+    nwb = MiesNwb(filename, cache_notebook=True)
+    cached = nwb.notebook()
+    assert nwb._nb_records is None
+    assert cached[0][0]['Clamp Mode'] == 1
+    assert cached[0][0]['LPF Cutoff'] is None
+    assert [dict(ch) for ch in cached[0]] == [dict(ch) for ch in nb[0]]
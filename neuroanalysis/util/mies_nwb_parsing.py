@@ -1,8 +1,15 @@
-from collections import OrderedDict
 import numpy as np
 from datetime import datetime
 
 
+# seconds from the IgorPro epoch (1904-01-01) to the unix epoch (1970-01-01)
+_IGOR_EPOCH_OFFSET = 2082844800
+
+# dtype of scaled primary / command traces. Recordings are digitized at 16 bits or less;
+# float32 holds them without loss and halves memory use and bandwidth relative to float64.
+TRACE_DTYPE = np.float32
+
+
 def parse_lab_notebook(hdf):
     """Return compiled data from the lab notebook in the given hdf.
 
@@ -22,18 +29,20 @@ def parse_lab_notebook(hdf):
         """
 
     # collect all lab notebook entries
-    sweep_entries = OrderedDict()
+    sweep_entries = {}
     tp_entries = []
     device = list(hdf['general/devices'].keys())[0].split('_',1)[-1]
-    nb_keys = hdf['general']['labnotebook'][device]['numericalKeys'][0]
-    nb_fields = OrderedDict([(k, i) for i,k in enumerate(nb_keys)])
+    nb_keys = list(hdf['general']['labnotebook'][device]['numericalKeys'][0])
 
     # convert notebook to array here, otherwise we incur the decompression cost for the entire
     # dataset every time we try to access part of it. 
     nb = np.array(hdf['general']['labnotebook'][device]['numericalValues'])
 
-    # EntrySourceType field is needed to distinguish between records created by TP vs sweep
-    entry_source_type_index = nb_fields.get('EntrySourceType', None)
+    # EntrySourceType field is needed to distinguish between records created by TP vs sweep;
+    # the TP fields are used to identify TP records in older files (see below)
+    entry_source_type_index = nb_keys.index('EntrySourceType') if 'EntrySourceType' in nb_keys else None
+    tp_peak_index = nb_keys.index('TP Peak Resistance') if 'TP Peak Resistance' in nb_keys else None
+    tp_dur_index = nb_keys.index('TP Pulse Duration') if 'TP Pulse Duration' in nb_keys else None
     
     nb_iter = iter(range(nb.shape[0]))  # so we can skip multiple rows from within the loop
     for i in nb_iter:
@@ -54,9 +63,8 @@ def parse_lab_notebook(hdf):
             # Older files may be missing EntrySourceType. In this case, we can identify TP blocks
             # as two records containing a "TP Peak Resistance" value in the first record followed
             # by a "TP Pulse Duration" value in the second record.
-            tp_peak = rec[nb_fields['TP Peak Resistance']]
-            if any(np.isfinite(tp_peak)):
-                tp_dur = nb[i+1][nb_fields['TP Pulse Duration']]
+            if tp_peak_index is not None and tp_dur_index is not None and any(np.isfinite(rec[tp_peak_index])):
+                tp_dur = nb[i+1][tp_dur_index]
                 if any(np.isfinite(tp_dur)):
                     next(nb_iter)
                     is_tp_record = True
@@ -80,6 +88,7 @@ def parse_lab_notebook(hdf):
                 mask = ~np.isnan(rec)
                 sweep_entries[sweep_num][mask] = rec[mask]
 
+    async_ad_fields = np.array([i for i,k in enumerate(nb_keys) if k.startswith('Async AD ')], dtype=int)
     for swid, entry in sweep_entries.items():
         # last column is "global"; applies to all channels
         mask = ~np.isnan(entry[:,8])
@@ -91,21 +100,16 @@ def parse_lab_notebook(hdf):
         # async AD fields (notably used to record temperature) appear
         # only in column 0, but might move to column 8 later? Since these
         # are not channel-specific, we'll copy them to all channels
-        for i,k in enumerate(nb_keys):
-            if not k.startswith('Async AD '):
-                continue
-            entry[i] = entry[i, 0]
+        entry[async_ad_fields] = entry[async_ad_fields, 0:1]
 
-        # convert to list-o-dicts
-        meta = []
-        for i in range(entry.shape[1]):
-            tm = entry[:, i]
-            meta.append(OrderedDict([(nb_keys[j], (None if np.isnan(tm[j]) else tm[j])) for j in range(len(nb_keys))]))
-        sweep_entries[swid] = meta
+        # convert to list-o-dicts (nan values become None)
+        entry_obj = entry.astype(object)
+        entry_obj[np.isnan(entry)] = None
+        sweep_entries[swid] = [dict(zip(nb_keys, entry_obj[:, i].tolist())) for i in range(entry.shape[1])]
 
     # Load textual keys in a similar way 
     text_nb_keys = hdf['general']['labnotebook'][device]['textualKeys'][0]
-    text_nb_fields = OrderedDict([(k, i) for i,k in enumerate(text_nb_keys)])
+    text_nb_fields = {k: i for i, k in enumerate(text_nb_keys)}
     text_nb = np.array(hdf['general']['labnotebook'][device]['textualValues'])
     entry_source_type_index = text_nb_fields.get('EntrySourceType', None)
 
@@ -155,8 +159,26 @@ def igorpro_date(timestamp):
     """Convert an IgorPro timestamp (seconds since 1904-01-01) to a datetime
     object.
     """
-    dt = datetime(1970,1,1) - datetime(1904,1,1)
-    return datetime.utcfromtimestamp(timestamp) - dt
+    return datetime.utcfromtimestamp(timestamp - _IGOR_EPOCH_OFFSET)
+
+def read_scaled_data(hdf_data, scale=None, offset=None, dtype=None):
+    """Read an HDF5 dataset directly into a new array, then apply *scale* and
+    *offset* in place.
+
+    This avoids the temporary arrays created by ``np.array(hdf_data) * scale + offset``.
+    If *dtype* is not given, the returned dtype is the same as that expression would produce.
+    """
+    if dtype is None:
+        args = [a for a in (scale, offset) if a is not None]
+        dtype = np.result_type(hdf_data.dtype, *args)
+    data = np.empty(hdf_data.shape, dtype=dtype)
+    if data.size > 0:
+        hdf_data.read_direct(data)
+    if scale is not None:
+        data *= scale
+    if offset is not None:
+        data += offset
+    return data
 
 def parse_stim_wave_note(rec_notebook):
     """Return (version, epochs) from the stim wave note of the labnotebook associated with a recording.